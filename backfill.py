@@ -0,0 +1,373 @@
+# backfill.py — Offline bulk reprocessing with dry-run planning, bounded parallelism and resume
+#
+# Examples:
+#   python backfill.py --since 2024-01-01 --from-stage clean --dry-run
+#   python backfill.py --model-version small --workers 4
+#   python backfill.py --language he --status document_created --from-stage summarize
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import config
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# === ⚙️ Settings ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCK_FILE = os.path.join(BASE_DIR, "pipeline.lock")
+DEFAULT_STATE_FILE = os.path.join(BASE_DIR, "backfill_state.json")
+
+STAGES = ["transcribe", "clean", "summarize", "doc"]
+
+# Rows transcribed before whisper_model was recorded have it NULL; they all used this checkpoint
+LEGACY_WHISPER_MODEL = "medium"
+PAGE_SIZE = 1000
+
+# Rough planning constants
+AUDIO_BYTES_PER_HOUR = 128_000 / 8 * 3600   # ~128 kbps encoded audio
+WORDS_PER_HOUR = 150 * 60                   # conversational speech
+TOKENS_PER_WORD = 1.33
+CHARS_PER_TOKEN = 4
+CLEAN_PROMPT_TOKENS = 150
+SUMMARY_PROMPT_TOKENS = 200
+SUMMARY_OUTPUT_TOKENS = 400
+
+# === 🕒 Logger ===
+def log(msg):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    formatted = f"[{timestamp}] {msg}"
+    print(formatted)
+    try:
+        with open("log.txt", "a") as f:
+            f.write(formatted + "\n")
+    except Exception as e:
+        print(f"[Logger Error] Could not write to log.txt: {e}")
+
+# === 🧾 CLI ===
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Reprocess historical audio_files records.")
+    parser.add_argument("--since", help="Only records created on/after this date (YYYY-MM-DD).")
+    parser.add_argument("--until", help="Only records created before this date (YYYY-MM-DD).")
+    parser.add_argument("--language", help="Only records with this detected language.")
+    parser.add_argument("--status", nargs="+", help="Only records in one of these statuses.")
+    parser.add_argument("--model-version",
+                        help=f"Only records transcribed with this Whisper model "
+                             f"('{LEGACY_WHISPER_MODEL}' also matches rows that predate whisper_model).")
+    parser.add_argument("--from-stage", choices=STAGES, default="transcribe",
+                        help="First stage to rerun; every later stage reruns too.")
+    parser.add_argument("--limit", type=int, help="Process at most this many records.")
+    parser.add_argument("--workers", type=int, default=2, help="Records processed in parallel.")
+    parser.add_argument("--dry-run", action="store_true", help="Print the plan and exit.")
+    parser.add_argument("--state-file", default=DEFAULT_STATE_FILE, help="Progress file used to resume.")
+    parser.add_argument("--fresh", action="store_true", help="Ignore previous progress in the state file.")
+    return parser.parse_args(argv)
+
+# === 🔎 Record Selection ===
+def fetch_records(sb, args):
+    records, offset = [], 0
+    while True:
+        query = sb.table("audio_files").select("*")
+        if args.since:
+            query = query.gte("created_at", args.since)
+        if args.until:
+            query = query.lt("created_at", args.until)
+        if args.language:
+            query = query.eq("language", args.language)
+        if args.status:
+            query = query.in_("status", args.status)
+        if args.model_version == LEGACY_WHISPER_MODEL:
+            query = query.or_(f"whisper_model.eq.{LEGACY_WHISPER_MODEL},whisper_model.is.null")
+        elif args.model_version:
+            query = query.eq("whisper_model", args.model_version)
+
+        page = query.order("id").range(offset, offset + PAGE_SIZE - 1).execute().data or []
+        records.extend(page)
+        if len(page) < PAGE_SIZE or (args.limit and len(records) >= args.limit):
+            break
+        offset += PAGE_SIZE
+
+    return records[:args.limit] if args.limit else records
+
+def list_drive_sizes():
+    import transcribe
+    service = transcribe.init_drive_service()
+    query = f"'{config.INPUT_FOLDER_ID}' in parents and trashed = false"
+    sizes, page_token = {}, None
+    while True:
+        results = service.files().list(
+            q=query, spaces="drive", fields="nextPageToken, files(name, size)", pageToken=page_token
+        ).execute()
+        for f in results.get("files", []):
+            if f.get("size"):
+                sizes[f["name"]] = int(f["size"])
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            return sizes
+
+# === 📐 Planning ===
+def estimate_audio_hours(record, drive_sizes):
+    segments = record.get("segments")
+    if segments:
+        return segments[-1]["end"] / 3600
+    if record.get("transcription"):
+        return len(record["transcription"].split()) / WORDS_PER_HOUR
+    size = drive_sizes.get(record["filename"])
+    if size:
+        return size / AUDIO_BYTES_PER_HOUR
+    return None
+
+def text_tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+def build_plan(records, stages, state, drive_sizes, combined_mode):
+    plan = {
+        "records": 0, "audio_hours": 0.0, "unknown_durations": 0,
+        "input_tokens": 0, "output_tokens": 0, "openai_calls": 0, "google_calls": 0,
+        "skipped_stages": 0,
+    }
+
+    for record in records:
+        pending = [s for s in stages if s not in state.get(str(record["id"]), [])]
+        plan["skipped_stages"] += len(stages) - len(pending)
+        if not pending:
+            continue
+        plan["records"] += 1
+
+        hours = estimate_audio_hours(record, drive_sizes)
+        if "transcribe" in pending:
+            plan["google_calls"] += 2  # lookup + download
+            if hours is None:
+                plan["unknown_durations"] += 1
+            else:
+                plan["audio_hours"] += hours
+
+        if "transcribe" in pending or not record.get("transcription"):
+            transcript_tokens = int((hours or 0) * WORDS_PER_HOUR * TOKENS_PER_WORD)
+        else:
+            transcript_tokens = text_tokens(record["transcription"])
+
+        if "clean" in pending:
+            plan["openai_calls"] += 1
+            plan["input_tokens"] += transcript_tokens + CLEAN_PROMPT_TOKENS
+            plan["output_tokens"] += transcript_tokens
+            if combined_mode:
+                plan["output_tokens"] += SUMMARY_OUTPUT_TOKENS
+
+        if "summarize" in pending and not (combined_mode and "clean" in pending):
+            cleaned_tokens = transcript_tokens
+            if "clean" not in pending and record.get("cleaned_text"):
+                cleaned_tokens = text_tokens(record["cleaned_text"])
+            plan["openai_calls"] += 1
+            plan["input_tokens"] += cleaned_tokens + SUMMARY_PROMPT_TOKENS
+            plan["output_tokens"] += SUMMARY_OUTPUT_TOKENS
+
+        if "doc" in pending:
+            plan["google_calls"] += 3 if config.OUTPUT_FOLDER_ID else 2
+
+    return plan
+
+def print_plan(plan, stages, total):
+    log("🗺️ Backfill plan")
+    log(f"   Stages:            {' → '.join(stages)}")
+    log(f"   Matching records:  {total}")
+    log(f"   Records to run:    {plan['records']}")
+    log(f"   Already done:      {plan['skipped_stages']} stage run(s) (resumed from state file)")
+    log(f"   Audio to decode:   {plan['audio_hours']:.2f} h"
+        + (f" (+{plan['unknown_durations']} file(s) of unknown length)" if plan["unknown_durations"] else ""))
+    log(f"   OpenAI tokens:     ~{plan['input_tokens']:,} in / ~{plan['output_tokens']:,} out")
+    log(f"   OpenAI calls:      {plan['openai_calls']}")
+    log(f"   Google API calls:  {plan['google_calls']}")
+
+# === 💾 Resume State ===
+# Progress only carries over to a rerun of the same selection
+def run_signature(args):
+    return json.dumps({
+        "since": args.since, "until": args.until, "language": args.language,
+        "status": args.status, "model_version": args.model_version,
+        "from_stage": args.from_stage, "limit": args.limit,
+    }, sort_keys=True)
+
+def load_state(path, signature):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        saved = json.load(f)
+    if saved.get("signature") != signature:
+        log("🆕 State file belongs to a different backfill, starting fresh.")
+        return {}
+    return saved.get("done", {})
+
+def save_state(path, signature, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"signature": signature, "done": state}, f)
+    os.replace(tmp, path)
+
+# === 🔒 Model access from worker threads ===
+class LockedModel:
+    # Whisper inference is serialized; LLM and Drive stages of other records keep running
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+
+    def transcribe(self, *args, **kwargs):
+        with self.lock:
+            return self.model.transcribe(*args, **kwargs)
+
+# === ▶️ Runner ===
+class Backfill:
+    def __init__(self, args, stages, state):
+        self.args = args
+        self.stages = stages
+        self.state = state
+        self.state_lock = threading.Lock()
+        self.local = threading.local()
+        self.model = None
+
+    def services(self):
+        # Supabase and Google clients aren't thread-safe, so each worker thread gets its own
+        if not hasattr(self.local, "sb"):
+            import transcribe
+            import create_doc
+            self.local.sb = transcribe.init_supabase()
+            self.local.drive = transcribe.init_drive_service()
+            self.local.doc_drive, self.local.docs = create_doc.init_drive_service()
+        return self.local
+
+    def mark_done(self, record_id, stage):
+        with self.state_lock:
+            self.state.setdefault(str(record_id), []).append(stage)
+            save_state(self.args.state_file, run_signature(self.args), self.state)
+
+    def run_stage(self, stage, record):
+        import transcribe
+        import clean_text
+        import summarize
+        import create_doc
+
+        svc = self.services()
+        if stage == "transcribe":
+            # Reprocessing on purpose, so don't link the record to a matching one
+            return transcribe.process_file(svc.sb, svc.drive, self.model, record, check_duplicates=False)
+        if stage == "clean":
+            return clean_text.process_record(svc.sb, record)
+        if stage == "summarize":
+            return summarize.process_record(svc.sb, record)
+        return create_doc.process_record(svc.sb, svc.doc_drive, svc.docs, record)
+
+    def process(self, record):
+        for stage in self.stages:
+            if stage in self.state.get(str(record["id"]), []):
+                continue
+            if not self.run_stage(stage, record):
+                return False
+            self.mark_done(record["id"], stage)
+
+            # Later stages need the columns this one just wrote
+            record = self.services().sb.table("audio_files").select("*").eq(
+                "id", record["id"]
+            ).execute().data[0]
+
+            # Streamed chunk cleaning already produced cleaned_text during transcription
+            if stage == "transcribe" and record.get("status") == "cleaned" and "clean" in self.stages:
+                self.mark_done(record["id"], "clean")
+            # Combined mode already summarized during cleaning
+            if stage == "clean" and record.get("status") == "summarized" and "summarize" in self.stages:
+                self.mark_done(record["id"], "summarize")
+        return True
+
+# === 🚀 MAIN ===
+def main(argv=None):
+    args = parse_args(argv)
+    stages = STAGES[STAGES.index(args.from_stage):]
+
+    import clean_text
+    import transcribe
+
+    sb = transcribe.init_supabase()
+    if args.fresh and os.path.exists(args.state_file):
+        os.remove(args.state_file)
+    state = load_state(args.state_file, run_signature(args))
+
+    log("📦 Selecting records...")
+    records = fetch_records(sb, args)
+
+    # Half-processed records may no longer match a --status filter; keep them in the run
+    selected = {str(r["id"]) for r in records}
+    unfinished = [rid for rid, done in state.items() if rid not in selected and len(done) < len(stages)]
+    if unfinished:
+        records += sb.table("audio_files").select("*").in_("id", unfinished).execute().data or []
+
+    if not records:
+        log("🟡 No records match the given filters.")
+        return
+
+    drive_sizes = {}
+    if "transcribe" in stages and any(
+        not (r.get("segments") or r.get("transcription")) for r in records
+    ):
+        drive_sizes = list_drive_sizes()
+
+    plan = build_plan(records, stages, state, drive_sizes, clean_text.COMBINED_MODE)
+    print_plan(plan, stages, len(records))
+    if args.dry_run or not plan["records"]:
+        return
+
+    if os.path.exists(LOCK_FILE):
+        log("⛔ A pipeline run is in progress (pipeline.lock exists). Try again later.")
+        return
+    open(LOCK_FILE, "w").close()
+
+    try:
+        runner = Backfill(args, stages, state)
+        if "transcribe" in stages:
+            log("🎙️ Loading Whisper model...")
+            import model_server
+            model = model_server.load_model(transcribe.WHISPER_MODEL)
+            # The shared server queues requests itself; only an in-process model needs the lock
+            runner.model = model if isinstance(model, model_server.WhisperClient) else LockedModel(model)
+
+        pending = [r for r in records if any(s not in state.get(str(r["id"]), []) for s in stages)]
+        total, completed, failed = len(pending), 0, 0
+        started = time.time()
+
+        executor = ThreadPoolExecutor(max_workers=max(1, args.workers))
+        try:
+            futures = {executor.submit(runner.process, r): r for r in pending}
+            for future in as_completed(futures):
+                record = futures[future]
+                try:
+                    ok = future.result()
+                except Exception as e:
+                    log(f"❌ Backfill failed for {record['filename']}: {type(e).__name__}: {e}")
+                    ok = False
+
+                completed += 1
+                failed += 0 if ok else 1
+                elapsed = time.time() - started
+                eta = elapsed / completed * (total - completed)
+                log(f"📊 [{completed}/{total}] {completed * 100 // total}% — "
+                    f"{'✅' if ok else '❌'} {record['filename']} — ETA {int(eta // 60)}m{int(eta % 60):02d}s")
+        except KeyboardInterrupt:
+            # Let records already in flight finish before the lock is released,
+            # otherwise cron could start a pipeline on the same rows
+            log("🛑 Interrupted — waiting for in-flight records, then exiting. Rerun the same command to resume.")
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+        log(f"✅ Backfill finished: {completed - failed} succeeded, {failed} failed.")
+    finally:
+        try:
+            os.remove(LOCK_FILE)
+        except Exception as e:
+            log(f"⚠️ Failed to remove lock file: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 # check_drive.py — Final version with lock file, absolute paths, and stable CRON support
 
 import os
+import sys
 import subprocess
 from datetime import datetime
 
@@ -9,6 +10,9 @@ LOCK_FILE = "pipeline.lock"
 PYTHON_EXECUTABLE = "/Users/kobiagi/Documents/Transcriber/venv310/bin/python"
 BASE_DIR = "/Users/kobiagi/Documents/Transcriber"
 
+sys.path.insert(0, BASE_DIR)
+import preflight
+
 PIPELINE_STEPS = [
     f"{BASE_DIR}/monitor.py",
     f"{BASE_DIR}/transcribe.py",
@@ -48,7 +52,19 @@ def run_step(script_path):
 # === Main Pipeline Execution ===
 def run_pipeline():
     log("🔍 Checking Google Drive for new audio files...")
-    for step_path in PIPELINE_STEPS:
+    monitor_step, stage_steps = PIPELINE_STEPS[0], PIPELINE_STEPS[1:]
+    if not run_step(monitor_step):
+        log(f"❌ Pipeline halted due to failure in {os.path.basename(monitor_step)}")
+        return
+
+    # Skip the heavy stage processes entirely when their queues are empty. Failed rows
+    # ('error', 'summary_error') count as work once every preflight.RETRY_INTERVAL_MINUTES
+    steps = preflight.steps_with_work(stage_steps)
+    if not steps:
+        log("😴 All stage queues are empty. Nothing to do.")
+        return
+
+    for step_path in steps:
         if not run_step(step_path):
             log(f"❌ Pipeline halted due to failure in {os.path.basename(step_path)}")
             break
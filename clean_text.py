@@ -2,14 +2,18 @@
 
 import os
 import sys
+import json
 from datetime import datetime
-from supabase import create_client
-import openai
-from openai.error import OpenAIError
 import config
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+# Stage queue, also counted by preflight.py
+QUEUE_STATUSES = ["transcribed", "error"]
+
+# With diarization on, clean the speaker-labelled copy of the transcript when there is one
+SPEAKER_LABELS = getattr(config, "ENABLE_DIARIZATION", False)
+
 # === Logger ===
 def log(msg):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -23,9 +27,44 @@ def log(msg):
 
 # === Supabase & OpenAI ===
 def init_supabase():
+    from supabase import create_client
     return create_client(config.SUPABASE_URL, config.SUPABASE_API_KEY)
 
-openai.api_key = config.OPENAI_API_KEY
+def init_openai():
+    import openai
+    openai.api_key = config.OPENAI_API_KEY
+    return openai
+
+# === Combined Mode ===
+# When enabled, cleaning and summarization happen in a single function-calling
+# request and the record goes straight to 'summarized'. Falls back to the
+# regular clean -> summarize path if the structured call fails.
+COMBINED_MODE = getattr(config, "COMBINED_LLM_MODE", False)
+
+MEETING_NOTES_FUNCTION = {
+    "name": "save_meeting_notes",
+    "description": "Store the cleaned meeting transcript together with its summary.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "cleaned_text": {
+                "type": "string",
+                "description": "The full transcript after linguistic cleanup, preserving meaning and intent.",
+            },
+            "talking_points": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "Main talking points of the meeting, one per item.",
+            },
+            "action_items": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "Action items from the meeting, one per item.",
+            },
+        },
+        "required": ["cleaned_text", "talking_points", "action_items"],
+    },
+}
 
 # === GPT Cleaner ===
 def clean_text_gpt(text):
@@ -33,11 +72,14 @@ def clean_text_gpt(text):
         "You are a distinguished professor of linguistics from the world's top linguistics faculty. "
         "You specialize in understanding texts written by individuals with cognitive challenges and fixing them "
         "while fully preserving their meaning and intent. You correct broken words, redundant letters, fragmented "
-        "sentences, and other linguistic issues.\n\n"
+        "sentences, and other linguistic issues. Keep any speaker labels (e.g. \"Speaker 1:\") exactly as they are.\n\n"
         "Please review the following text and fix it if needed:\n\n"
         f"{text}"
     )
 
+    openai = init_openai()
+    from openai.error import OpenAIError
+
     models = ["gpt-4", "gpt-3.5-turbo-16k"]
     for model in models:
         try:
@@ -54,14 +96,129 @@ def clean_text_gpt(text):
                 break
     return None
 
+# === GPT Cleaner + Summarizer (single structured call) ===
+def clean_and_summarize_gpt(text):
+    prompt = (
+        "You are a distinguished professor of linguistics from the world's top linguistics faculty, "
+        "acting as a business meeting assistant. The text below is a meeting transcription that may contain "
+        "broken words, redundant letters, fragmented sentences, and other linguistic issues.\n\n"
+        "1. Fix the text while fully preserving its meaning and intent.\n"
+        "2. Summarize the meeting into its main talking points and its action items.\n\n"
+        "If the transcription labels speakers (e.g. \"Speaker 1:\"), keep the labels in the cleaned text "
+        "and start each action item with its owner (e.g. \"Speaker 2: Send the report\").\n\n"
+        "Return the result by calling the save_meeting_notes function.\n\n"
+        f"Meeting transcription:\n{text}"
+    )
+
+    openai = init_openai()
+    from openai.error import OpenAIError
+
+    # Like clean_text_gpt, only a context-length error moves on to the larger-context model;
+    # any other failure goes straight to the clean -> summarize fallback
+    models = ["gpt-4", "gpt-3.5-turbo-16k"]
+    for model in models:
+        try:
+            log(f"🧠 Using model (combined): {model}")
+            response = openai.ChatCompletion.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                functions=[MEETING_NOTES_FUNCTION],
+                function_call={"name": MEETING_NOTES_FUNCTION["name"]},
+                temperature=0.4,
+            )
+            call = response.choices[0].message.get("function_call")
+            if not call:
+                log(f"⚠️ Model {model} did not return a function call.")
+                break
+
+            result = json.loads(call["arguments"])
+            cleaned = (result.get("cleaned_text") or "").strip()
+            points = [p.strip() for p in result.get("talking_points") or [] if p and p.strip()]
+            actions = [a.strip() for a in result.get("action_items") or [] if a and a.strip()]
+            if not (cleaned and points and actions):
+                log(f"⚠️ Model {model} returned incomplete meeting notes.")
+                break
+
+            return {"cleaned_text": cleaned, "talking_points": points, "action_items": actions}
+        except json.JSONDecodeError as e:
+            log(f"⚠️ Invalid JSON arguments from model {model}: {e}")
+            break
+        except OpenAIError as e:
+            log(f"❌ OpenAI error with model {model}: {e}")
+            if "maximum context length" not in str(e) and "too many tokens" not in str(e):
+                break
+    return None
+
+# === Summary Markdown (same layout summarize.py asks GPT for) ===
+def format_summary_markdown(talking_points, action_items):
+    lines = ["## Main Talking Points"]
+    lines += [f"- {point}" for point in talking_points]
+    lines += ["", "## Action Items"]
+    lines += [f"- {action}" for action in action_items]
+    return "\n".join(lines)
+
+# === Clean One Record ===
+def process_record(sb, record):
+    file_id = record["id"]
+    filename = record["filename"]
+    raw_text = record.get("transcription")
+    if SPEAKER_LABELS and record.get("speaker_transcript"):
+        raw_text = record["speaker_transcript"]
+
+    if not raw_text:
+        log(f"⚠️ Skipping {filename} — no transcription found.")
+        return False
+
+    try:
+        if COMBINED_MODE:
+            notes = clean_and_summarize_gpt(raw_text)
+            if notes:
+                sb.table("audio_files").update({
+                    "status": "summarized",
+                    "cleaned_text": notes["cleaned_text"],
+                    "summary_points": notes["talking_points"],
+                    "action_items": notes["action_items"],
+                    "full_summary": format_summary_markdown(
+                        notes["talking_points"], notes["action_items"]
+                    ),
+                    "error_message": ""
+                }).eq("id", file_id).execute()
+
+                log(f"✅ Cleaned and summarized: {filename}")
+                return True
+
+            log(f"↩️ Combined call failed for {filename}, falling back to cleaning only.")
+
+        cleaned = clean_text_gpt(raw_text)
+        if not cleaned:
+            raise Exception("No cleaned text returned from GPT")
+
+        sb.table("audio_files").update({
+            "status": "cleaned",
+            "cleaned_text": cleaned,
+            "error_message": ""
+        }).eq("id", file_id).execute()
+
+        log(f"✅ Cleaned: {filename}")
+        return True
+
+    except Exception as e:
+        log(f"❌ Error cleaning {filename}: {type(e).__name__}: {str(e)}")
+        sb.table("audio_files").update({
+            "status": "error",
+            "error_message": str(e)
+        }).eq("id", file_id).execute()
+        return False
+
 # === Main Cleaning Flow ===
 def main():
     log("🧹 Starting GPT-based transcript cleaning...")
     sb = init_supabase()
 
     log("📦 Fetching records with status='transcribed' or 'error'...")
-    records = sb.table("audio_files").select("id, filename, transcription, status").in_(
-        "status", ["transcribed", "error"]
+    columns = "id, filename, transcription, status" + (", speaker_transcript" if SPEAKER_LABELS else "")
+    records = sb.table("audio_files").select(columns).in_(
+        "status", QUEUE_STATUSES
     ).execute().data
 
     if not records:
@@ -69,33 +226,7 @@ def main():
         return
 
     for record in records:
-        file_id = record["id"]
-        filename = record["filename"]
-        raw_text = record.get("transcription")
-
-        if not raw_text:
-            log(f"⚠️ Skipping {filename} — no transcription found.")
-            continue
-
-        try:
-            cleaned = clean_text_gpt(raw_text)
-            if not cleaned:
-                raise Exception("No cleaned text returned from GPT")
-
-            sb.table("audio_files").update({
-                "status": "cleaned",
-                "cleaned_text": cleaned,
-                "error_message": ""
-            }).eq("id", file_id).execute()
-
-            log(f"✅ Cleaned: {filename}")
-
-        except Exception as e:
-            log(f"❌ Error cleaning {filename}: {type(e).__name__}: {str(e)}")
-            sb.table("audio_files").update({
-                "status": "error",
-                "error_message": str(e)
-            }).eq("id", file_id).execute()
+        process_record(sb, record)
 
     log("✅ Step 2 Complete: Cleaning process finished.")
 
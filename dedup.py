@@ -0,0 +1,154 @@
+# dedup.py — Match uploads against already processed audio by content hash or audio fingerprint
+#
+# A match is only linked once the original has finished outputs. Until then the
+# upload waits as 'duplicate_pending' (no stage picks it up) and monitor.py
+# resolves it on a later tick: copy the outputs, or process it normally if the
+# original failed or hasn't finished within DUPLICATE_PENDING_HOURS.
+#
+# Columns: migrations/003_duplicate_audio.sql
+
+import json
+import shutil
+import subprocess
+from datetime import datetime, timedelta, timezone
+import config
+
+# === ⚙️ Settings ===
+# Perceptual matching needs Chromaprint's fpcalc on PATH; md5 matching always runs
+FINGERPRINT_DEDUP = getattr(config, "FINGERPRINT_DEDUP", False)
+FINGERPRINT_THRESHOLD = getattr(config, "FINGERPRINT_THRESHOLD", 0.9)
+# Only the opening stretch is fingerprinted (fpcalc's own default is 120 s); the
+# duration check below stops recordings that merely share an intro from matching
+FINGERPRINT_SECONDS = getattr(config, "FINGERPRINT_SECONDS", 120)
+FINGERPRINT_MAX_SHIFT = 8
+DURATION_TOLERANCE_SECONDS = 2.0
+FPCALC = shutil.which("fpcalc")
+
+# Pipeline outputs a duplicate shares with the record it links to
+LINKED_FIELDS = [
+    "language", "transcription", "segments", "speaker_transcript", "cleaned_text",
+    "summary_points", "action_items", "full_summary",
+]
+# An original is finished once these are all filled in, whatever its status: a row
+# whose doc creation failed is 'error' but has everything a duplicate needs
+SUMMARY_FIELDS = ["full_summary", "summary_points", "action_items"]
+# Rows that can never serve as an original
+NOT_ORIGINAL_STATUSES = ["duplicate", "duplicate_pending"]
+# ...and 'error' rows only count when they got as far as a summary
+ORIGINAL_FILTER = "status.neq.error,full_summary.not.is.null"
+
+# Stop waiting on an original that hasn't finished (e.g. stuck in 'summary_error')
+DUPLICATE_PENDING_HOURS = getattr(config, "DUPLICATE_PENDING_HOURS", 24)
+
+def utc_timestamp(moment):
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+# === 🔗 Linking ===
+def fetch_original(supabase, original_id):
+    if original_id is None:
+        return None
+    rows = supabase.table("audio_files").select(
+        ", ".join(["id", "status"] + LINKED_FIELDS)
+    ).eq("id", original_id).execute().data
+    return rows[0] if rows else None
+
+def is_finished(original):
+    return all(original.get(k) for k in SUMMARY_FIELDS)
+
+def duplicate_fields(original):
+    fields = {
+        "status": "duplicate", "duplicate_of": original["id"],
+        "duplicate_pending_since": None, "error_message": "",
+    }
+    fields.update({k: original[k] for k in LINKED_FIELDS if original.get(k) is not None})
+    return fields
+
+def pending_fields(original_id):
+    return {
+        "status": "duplicate_pending",
+        "duplicate_of": original_id,
+        "duplicate_pending_since": utc_timestamp(datetime.now(timezone.utc)),
+        "error_message": "",
+    }
+
+def link_fields(supabase, original_id):
+    # Full copy when the original is done, otherwise wait for it
+    original = fetch_original(supabase, original_id)
+    if original and is_finished(original):
+        return duplicate_fields(original)
+    return pending_fields(original_id)
+
+# === ⏳ Resolve duplicates waiting on their original ===
+def process_on_its_own(supabase, row):
+    supabase.table("audio_files").update({
+        "status": "new", "duplicate_of": None, "duplicate_pending_since": None
+    }).eq("id", row["id"]).execute()
+
+def resolve_pending(supabase, log):
+    rows = supabase.table("audio_files").select("id, filename, duplicate_of").eq(
+        "status", "duplicate_pending"
+    ).execute().data or []
+    if not rows:
+        return
+
+    cutoff = utc_timestamp(datetime.now(timezone.utc) - timedelta(hours=DUPLICATE_PENDING_HOURS))
+    expired = {row["id"] for row in supabase.table("audio_files").select("id").eq(
+        "status", "duplicate_pending"
+    ).or_(f"duplicate_pending_since.lt.{cutoff},duplicate_pending_since.is.null").execute().data or []}
+
+    for row in rows:
+        original = fetch_original(supabase, row["duplicate_of"])
+        if original and is_finished(original):
+            log(f"♻️ Linking {row['filename']} to finished record {original['id']}.")
+            supabase.table("audio_files").update(duplicate_fields(original)).eq("id", row["id"]).execute()
+        elif not original or original["status"] == "error":
+            log(f"🔁 Original of {row['filename']} failed, processing it on its own.")
+            process_on_its_own(supabase, row)
+        elif row["id"] in expired:
+            log(f"⌛ {row['filename']} waited over {DUPLICATE_PENDING_HOURS}h for record {original['id']} "
+                f"('{original['status']}'), processing it on its own.")
+            process_on_its_own(supabase, row)
+
+# === #️⃣ Content hash (Drive md5Checksum) ===
+def load_checksum_index(supabase):
+    rows = supabase.table("audio_files").select("id, md5_checksum").not_.is_(
+        "md5_checksum", "null"
+    ).not_.in_("status", NOT_ORIGINAL_STATUSES).or_(ORIGINAL_FILTER).execute().data or []
+    return {row["md5_checksum"]: row["id"] for row in rows}
+
+# === 🎵 Perceptual fingerprint (Chromaprint) ===
+def compute_fingerprint(path):
+    if not FPCALC:
+        return None, None
+    result = subprocess.run(
+        [FPCALC, "-raw", "-json", "-length", str(FINGERPRINT_SECONDS), path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, text=True
+    )
+    data = json.loads(result.stdout)
+    return data["fingerprint"], data["duration"]
+
+def fingerprint_similarity(a, b):
+    # Best bitwise agreement over small alignment shifts between the two raw fingerprints
+    best = 0.0
+    for shift in range(-FINGERPRINT_MAX_SHIFT, FINGERPRINT_MAX_SHIFT + 1):
+        pairs = list(zip(a[max(shift, 0):], b[max(-shift, 0):]))
+        if not pairs:
+            continue
+        errors = sum(bin(x ^ y).count("1") for x, y in pairs)
+        best = max(best, 1 - errors / (32 * len(pairs)))
+    return best
+
+def find_fingerprint_match(supabase, fingerprint, duration, exclude_id=None):
+    # Duration is filtered server-side so only plausible candidates are fetched and compared
+    rows = supabase.table("audio_files").select("id, audio_fingerprint").not_.is_(
+        "audio_fingerprint", "null"
+    ).not_.in_("status", NOT_ORIGINAL_STATUSES).or_(ORIGINAL_FILTER).gte(
+        "audio_duration", duration - DURATION_TOLERANCE_SECONDS
+    ).lte("audio_duration", duration + DURATION_TOLERANCE_SECONDS).execute().data or []
+
+    for row in rows:
+        if row["id"] == exclude_id:
+            continue
+        if fingerprint_similarity(fingerprint, row["audio_fingerprint"]) >= FINGERPRINT_THRESHOLD:
+            return row["id"]
+    return None
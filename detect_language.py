@@ -2,16 +2,14 @@ import os
 import tempfile
 import traceback
 from datetime import datetime
-
-import whisper
-from supabase import create_client
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 import io
 
+import model_server
 from config import SUPABASE_URL, SUPABASE_API_KEY, SERVICE_ACCOUNT_FILE, INPUT_FOLDER_ID
 
+# Stage queue, also counted by preflight.py
+QUEUE_STATUSES = ["new"]
+
 # === Logging ===
 def log(msg):
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -19,10 +17,13 @@ def log(msg):
 
 # === Initialize Supabase ===
 def init_supabase():
+    from supabase import create_client
     return create_client(SUPABASE_URL, SUPABASE_API_KEY)
 
 # === Initialize Google Drive API ===
 def init_drive_service():
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
     creds = service_account.Credentials.from_service_account_file(
         SERVICE_ACCOUNT_FILE,
         scopes=["https://www.googleapis.com/auth/drive"]
@@ -31,6 +32,7 @@ def init_drive_service():
 
 # === Download File from Google Drive ===
 def download_from_drive(filename, drive_service, download_path="downloads"):
+    from googleapiclient.http import MediaIoBaseDownload
     log(f"🔽 Downloading from Drive: {filename}")
     query = f"name='{filename}' and '{INPUT_FOLDER_ID}' in parents and trashed = false"
     results = drive_service.files().list(
@@ -60,21 +62,23 @@ def download_from_drive(filename, drive_service, download_path="downloads"):
     return local_path
 
 # === Detect Language ===
-def detect_language(audio_path):
-    model = whisper.load_model("medium")  # Change to "large-v3" if you want more accuracy
-    result = model.transcribe(audio_path, task="transcribe", fp16=False)
-    return result.get("language", "unknown")
+def detect_language(model, audio_path):
+    # Whisper decides the language from the first 30s window; no need to transcribe the whole file
+    return model_server.identify_language(model, audio_path) or "unknown"
 
 # === Main ===
 def main():
-    log("🧠 Loading Whisper model...")
-    supabase = init_supabase()
-    drive_service = init_drive_service()
-
     log("📦 Connecting to Supabase...")
-    response = supabase.table("audio_files").select("id, filename").eq("status", "new").execute()
+    supabase = init_supabase()
+    response = supabase.table("audio_files").select("id, filename").in_("status", QUEUE_STATUSES).execute()
     rows = response.data or []
     log(f"🔎 Found {len(rows)} file(s) to process.")
+    if not rows:
+        return
+
+    log("🧠 Loading Whisper model...")
+    model = model_server.load_model()
+    drive_service = init_drive_service()
 
     for row in rows:
         filename = row["filename"]
@@ -84,7 +88,7 @@ def main():
         try:
             log("🔍 Detecting language...")
             temp_audio = download_from_drive(filename, drive_service)
-            lang = detect_language(temp_audio)
+            lang = detect_language(model, temp_audio)
 
             supabase.table("audio_files").update({
                 "language": lang,
@@ -0,0 +1,263 @@
+# diarize.py — CPU speaker diarization over Whisper segments, embeddings cached by audio hash
+#
+# EXPERIMENTAL: speakers are told apart by per-band log-mel statistics, not a trained
+# speaker-embedding model, and the labels have not been validated against annotated
+# meetings. Expect merged or split speakers, and check action-item owners by hand.
+# Workers only import numpy, so they stay small under the spawn start method (macOS).
+
+import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from datetime import datetime
+
+import numpy as np
+import config
+
+# === ⚙️ Settings ===
+SAMPLE_RATE = 16000  # whisper.audio.SAMPLE_RATE; Whisper decodes to 16 kHz mono
+N_FFT = 400
+HOP_LENGTH = 160
+N_MELS = 80
+WINDOW_SECONDS = 1.5
+HOP_SECONDS = 0.75
+WINDOWS_PER_TASK = 200
+
+CACHE_DIR = getattr(config, "DIARIZATION_CACHE_DIR", "diarization_cache")
+SIMILARITY_THRESHOLD = getattr(config, "DIARIZATION_THRESHOLD", 0.75)
+MAX_SPEAKERS = getattr(config, "DIARIZATION_MAX_SPEAKERS", 8)
+# Whisper already uses every core; keep the embedding pool small
+WORKERS = getattr(config, "DIARIZATION_WORKERS", 2)
+
+# === 🕒 Logger ===
+def log(msg):
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    formatted = f"[{timestamp}] {msg}"
+    print(formatted)
+    try:
+        with open("log.txt", "a") as f:
+            f.write(formatted + "\n")
+    except Exception as e:
+        print(f"[Logger Error] Could not write to log.txt: {e}")
+
+# === 🗄️ Cache (window embeddings keyed by hash of the decoded audio) ===
+# Embeddings depend only on the audio, not on how Whisper segmented it, so a cache hit
+# survives model changes and streaming chunk boundaries; only the cheap clustering reruns.
+def audio_hash(audio):
+    return hashlib.sha256(np.ascontiguousarray(audio).tobytes()).hexdigest()
+
+def cache_path(digest):
+    return os.path.join(CACHE_DIR, f"{digest}.npz")
+
+def load_cached(digest):
+    path = cache_path(digest)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as cached:
+            return cached["offsets"], cached["embeddings"]
+    except Exception as e:
+        log(f"⚠️ Ignoring unreadable diarization cache {path}: {e}")
+        return None
+
+def save_cached(digest, offsets, embeddings):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = cache_path(digest) + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, offsets=offsets, embeddings=embeddings)
+        os.replace(tmp, cache_path(digest))
+    except Exception as e:
+        log(f"⚠️ Couldn't write diarization cache: {e}")
+
+# === 🧮 Window Embeddings (run in worker processes) ===
+def mel_filterbank(n_mels=N_MELS, n_fft=N_FFT, sr=SAMPLE_RATE):
+    # Triangular HTK-style mel filters, like Whisper's but computed without torch
+    def hz_to_mel(hz):
+        return 2595 * np.log10(1 + hz / 700)
+
+    def mel_to_hz(mel):
+        return 700 * (10 ** (mel / 2595) - 1)
+
+    bins = np.fft.rfftfreq(n_fft, 1 / sr)
+    edges = mel_to_hz(np.linspace(hz_to_mel(0), hz_to_mel(sr / 2), n_mels + 2))
+    filters = np.zeros((n_mels, len(bins)))
+    for m in range(n_mels):
+        lo, center, hi = edges[m], edges[m + 1], edges[m + 2]
+        rising = (bins - lo) / (center - lo)
+        falling = (hi - bins) / (hi - center)
+        filters[m] = np.maximum(0, np.minimum(rising, falling))
+    return filters
+
+def log_mel(window, filters):
+    if len(window) < N_FFT:
+        window = np.pad(window, (0, N_FFT - len(window)))
+    frames = np.lib.stride_tricks.sliding_window_view(window, N_FFT)[::HOP_LENGTH]
+    power = np.abs(np.fft.rfft(frames * np.hanning(N_FFT), axis=1)) ** 2
+    return np.log10(np.maximum(power @ filters.T, 1e-10)).T
+
+def window_size():
+    return int(WINDOW_SECONDS * SAMPLE_RATE)
+
+def window_hop():
+    return int(HOP_SECONDS * SAMPLE_RATE)
+
+def window_count(n_samples):
+    return max(n_samples - window_size(), 0) // window_hop() + 1
+
+# Set once per worker by _init_worker: a view of the parent's audio in shared memory
+_worker = {}
+
+def _init_worker(shm_name, n_samples):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker["shm"] = shm  # keep the mapping alive for the worker's lifetime
+    _worker["audio"] = np.ndarray((n_samples,), dtype=np.float32, buffer=shm.buf)
+    _worker["filters"] = mel_filterbank()
+
+def _embed_windows(first, count):
+    # Mean and spread of each mel band — a cheap voice-timbre signature per window.
+    # Tasks carry window indices only; the samples are read from shared memory.
+    audio, filters = _worker["audio"], _worker["filters"]
+    size, hop = window_size(), window_hop()
+    features = []
+    for i in range(first, first + count):
+        mel = log_mel(audio[i * hop:i * hop + size], filters)
+        features.append(np.concatenate([mel.mean(axis=1), mel.std(axis=1)]))
+    return np.stack(features)
+
+# === ▶️ Start diarization alongside transcription ===
+def start_diarization(audio):
+    digest = audio_hash(audio)
+    cached = load_cached(digest)
+    if cached is not None:
+        log("🗄️ Using cached speaker embeddings.")
+        offsets, embeddings = cached
+        return {"hash": digest, "offsets": offsets, "embeddings": embeddings}
+
+    # One copy of the audio in shared memory instead of pickling overlapping windows to every task
+    audio = np.ascontiguousarray(audio, dtype=np.float32)
+    shm = shared_memory.SharedMemory(create=True, size=max(audio.nbytes, 1))
+    np.ndarray(audio.shape, dtype=np.float32, buffer=shm.buf)[:] = audio
+
+    n_windows = window_count(len(audio))
+    job = {
+        "hash": digest,
+        "offsets": np.arange(n_windows) * window_hop() / SAMPLE_RATE,
+        "embeddings": None,
+        "shm": shm,
+    }
+    try:
+        job["executor"] = ProcessPoolExecutor(
+            max_workers=WORKERS, initializer=_init_worker, initargs=(shm.name, len(audio))
+        )
+        job["futures"] = [
+            job["executor"].submit(_embed_windows, first, min(WINDOWS_PER_TASK, n_windows - first))
+            for first in range(0, n_windows, WINDOWS_PER_TASK)
+        ]
+    except Exception:
+        cancel_diarization(job)
+        raise
+    log(f"🗣️ Diarization started: {n_windows} window(s) on {WORKERS} worker(s).")
+    return job
+
+def release(job):
+    if job.get("executor"):
+        job["executor"].shutdown(wait=True, cancel_futures=True)
+        job["executor"] = None
+    if job.get("shm"):
+        job["shm"].close()
+        job["shm"].unlink()
+        job["shm"] = None
+
+def cancel_diarization(job):
+    release(job)
+
+def collect_embeddings(job):
+    if job["embeddings"] is None:
+        try:
+            job["embeddings"] = np.concatenate([f.result() for f in job["futures"]])
+        finally:
+            release(job)
+        save_cached(job["hash"], job["offsets"], job["embeddings"])
+    return job["embeddings"]
+
+# === 🔗 Clustering ===
+def cluster_embeddings(embeddings):
+    # Centroid-linkage agglomerative clustering on cosine similarity
+    def unit(v):
+        return v / (np.linalg.norm(v) + 1e-9)
+
+    centroids = np.stack(embeddings).astype(np.float64)
+    counts = np.ones(len(centroids))
+    members = [[i] for i in range(len(centroids))]
+    active = np.ones(len(centroids), dtype=bool)
+
+    units = np.stack([unit(c) for c in centroids])
+    sims = units @ units.T
+    np.fill_diagonal(sims, -np.inf)
+
+    while active.sum() > 1:
+        a, b = np.unravel_index(np.argmax(sims), sims.shape)
+        if sims[a, b] < SIMILARITY_THRESHOLD and active.sum() <= MAX_SPEAKERS:
+            break
+
+        # Merge b into a, then refresh only a's row/column
+        centroids[a] = (centroids[a] * counts[a] + centroids[b] * counts[b]) / (counts[a] + counts[b])
+        counts[a] += counts[b]
+        members[a] += members[b]
+        active[b] = False
+        sims[b, :] = sims[:, b] = -np.inf
+
+        units[a] = unit(centroids[a])
+        row = units @ units[a]
+        row[~active] = -np.inf
+        row[a] = -np.inf
+        sims[a, :] = sims[:, a] = row
+
+    labels = [0] * len(centroids)
+    for cluster, idx in enumerate(np.flatnonzero(active)):
+        for member in members[idx]:
+            labels[member] = cluster
+    return labels
+
+# === 🏷️ Assign speakers to Whisper segments ===
+def finish_diarization(job, segments):
+    window_embeddings = collect_embeddings(job)
+    if not segments:
+        return None
+
+    # Pool the windows overlapping each segment into one embedding per segment
+    centers = job["offsets"] + WINDOW_SECONDS / 2
+    pooled = []
+    for seg in segments:
+        start, end = seg["start"], seg["end"]
+        mask = (centers >= start) & (centers < end)
+        if not mask.any():
+            mask = np.zeros(len(centers), dtype=bool)
+            mask[np.argmin(np.abs(centers - (start + end) / 2))] = True
+        pooled.append(window_embeddings[mask].mean(axis=0))
+
+    pooled = np.stack(pooled)
+    pooled = pooled - pooled.mean(axis=0)
+    labels = cluster_embeddings(list(pooled))
+
+    # Number speakers by first appearance
+    names = {}
+    for label in labels:
+        names.setdefault(label, f"Speaker {len(names) + 1}")
+
+    log(f"🗣️ Diarization complete: {len(names)} speaker(s).")
+    return [dict(seg, speaker=names[labels[i]]) for i, seg in enumerate(segments)]
+
+# === 📝 Formatting ===
+def format_speaker_transcript(segments):
+    paragraphs = []
+    for seg in segments:
+        text = seg["text"].strip()
+        if not text:
+            continue
+        if paragraphs and paragraphs[-1][0] == seg["speaker"]:
+            paragraphs[-1][1].append(text)
+        else:
+            paragraphs.append((seg["speaker"], [text]))
+    return "\n\n".join(f"{speaker}: {' '.join(texts)}" for speaker, texts in paragraphs)
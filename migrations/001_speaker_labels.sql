@@ -0,0 +1,7 @@
+-- 001_speaker_labels.sql — Columns written by transcribe.py when ENABLE_DIARIZATION is on
+--
+-- transcription keeps Whisper's plain output; the speaker-labelled segments and
+-- transcript are stored next to it and cleaned in its place when present.
+
+ALTER TABLE audio_files ADD COLUMN IF NOT EXISTS segments jsonb;
+ALTER TABLE audio_files ADD COLUMN IF NOT EXISTS speaker_transcript text;
@@ -0,0 +1,11 @@
+-- 002_whisper_model.sql — Per-record Whisper checkpoint, written by transcribe.py on every run
+--
+-- Apply before deploying transcribe.py: its final update includes whisper_model, so
+-- without the column every transcription is marked 'error'. backfill.py filters on
+-- whisper_model (NULL rows count as the legacy 'medium' checkpoint) and on created_at.
+
+ALTER TABLE audio_files ADD COLUMN IF NOT EXISTS whisper_model text;
+ALTER TABLE audio_files ADD COLUMN IF NOT EXISTS created_at timestamptz NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS audio_files_whisper_model_idx ON audio_files (whisper_model);
+CREATE INDEX IF NOT EXISTS audio_files_created_at_idx ON audio_files (created_at);
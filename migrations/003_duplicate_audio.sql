@@ -0,0 +1,22 @@
+-- 003_duplicate_audio.sql — Duplicate upload detection (monitor.py, dedup.py, transcribe.py)
+--
+-- Apply before deploying monitor.py: every insert writes drive_file_id and
+-- md5_checksum, so without them no new file gets queued. dedup.py also copies
+-- segments and speaker_transcript, which 001_speaker_labels.sql adds.
+
+ALTER TABLE audio_files ADD COLUMN IF NOT EXISTS drive_file_id text;
+ALTER TABLE audio_files ADD COLUMN IF NOT EXISTS md5_checksum text;
+ALTER TABLE audio_files ADD COLUMN IF NOT EXISTS duplicate_of bigint REFERENCES audio_files (id) ON DELETE SET NULL;
+
+-- Chromaprint raw fingerprint (array of 32-bit ints) and duration in seconds,
+-- only written when FINGERPRINT_DEDUP is on
+ALTER TABLE audio_files ADD COLUMN IF NOT EXISTS audio_fingerprint jsonb;
+ALTER TABLE audio_files ADD COLUMN IF NOT EXISTS audio_duration double precision;
+
+CREATE INDEX IF NOT EXISTS audio_files_md5_checksum_idx ON audio_files (md5_checksum);
+CREATE INDEX IF NOT EXISTS audio_files_audio_duration_idx ON audio_files (audio_duration)
+    WHERE audio_fingerprint IS NOT NULL;
+
+-- Set while an upload waits on an unfinished original; monitor.py stops waiting
+-- after DUPLICATE_PENDING_HOURS and processes it on its own
+ALTER TABLE audio_files ADD COLUMN IF NOT EXISTS duplicate_pending_since timestamptz;
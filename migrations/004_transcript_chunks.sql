@@ -0,0 +1,17 @@
+-- 004_transcript_chunks.sql — Streaming transcription (STREAMING_TRANSCRIPTION)
+--
+-- Only needed with streaming on: transcribe.py inserts one row per finished chunk
+-- and updates audio_files.transcription_progress as it goes.
+
+ALTER TABLE audio_files ADD COLUMN IF NOT EXISTS transcription_progress integer;
+
+CREATE TABLE IF NOT EXISTS transcript_chunks (
+    audio_file_id bigint NOT NULL REFERENCES audio_files (id) ON DELETE CASCADE,
+    chunk_index integer NOT NULL,
+    start double precision NOT NULL,
+    "end" double precision NOT NULL,
+    text text,
+    cleaned_text text,
+    segments jsonb,
+    PRIMARY KEY (audio_file_id, chunk_index)
+);
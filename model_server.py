@@ -0,0 +1,306 @@
+# model_server.py — Warm Whisper model shared by forked workers over a Unix socket
+#
+# Start once per node:   python model_server.py
+# Clients call load_model(); it returns a WhisperClient when a server is listening on the
+# socket with the requested checkpoint, and falls back to an in-process model otherwise.
+
+import os
+import sys
+import json
+import time
+import select
+import signal
+import socket
+import struct
+import collections
+from datetime import datetime
+
+import config
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# === ⚙️ Settings ===
+SOCKET_PATH = getattr(config, "MODEL_SERVER_SOCKET", "/tmp/transcriber-whisper.sock")
+WORKERS = getattr(config, "MODEL_SERVER_WORKERS", 2)
+WHISPER_MODEL = getattr(config, "WHISPER_MODEL", "medium")
+BATCH_WINDOW_SECONDS = 0.05
+MAX_BATCH = 16
+
+HEADER = struct.Struct("!I")
+
+# Written next to the socket at startup; workers only read requests while idle, so the
+# checkpoint is published here rather than answered over a socket that may be busy
+def info_path(socket_path=SOCKET_PATH):
+    return socket_path + ".json"
+
+# === 🕒 Logger ===
+def log(msg):
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    formatted = f"[{timestamp}] {msg}"
+    print(formatted, flush=True)
+    try:
+        with open("log.txt", "a") as f:
+            f.write(formatted + "\n")
+    except Exception as e:
+        print(f"[Logger Error] Could not write to log.txt: {e}")
+
+# === 📨 Framing: 4-byte length + payload ===
+def recv_exact(conn, size):
+    chunks = []
+    while size:
+        chunk = conn.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Socket closed mid-message")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def send_frame(conn, payload):
+    conn.sendall(HEADER.pack(len(payload)) + payload)
+
+def recv_frame(conn):
+    (size,) = HEADER.unpack(recv_exact(conn, HEADER.size))
+    return recv_exact(conn, size)
+
+def to_json(obj):
+    return json.dumps(obj, default=lambda o: o.item() if hasattr(o, "item") else str(o)).encode()
+
+# === 🌐 Language identification (shared by server and local fallback) ===
+def clip_mel(model, audio):
+    import whisper
+    if isinstance(audio, str):
+        audio = whisper.load_audio(audio)
+    clip = whisper.pad_or_trim(audio)
+    return whisper.log_mel_spectrogram(clip, model.dims.n_mels).to(model.device)
+
+def detect_languages(model, mels):
+    import torch
+    with torch.no_grad():
+        _, probs = model.detect_language(torch.stack(mels))
+    return [max(p, key=p.get) for p in probs]
+
+def identify_language(model, audio):
+    if isinstance(model, WhisperClient):
+        return model.identify_language(audio)
+    return detect_languages(model, [clip_mel(model, audio)])[0]
+
+# === 🔌 Client ===
+class WhisperClient:
+    # Drop-in for the whisper model where the pipeline uses it: transcribe() returns the same dict
+    def __init__(self, socket_path=SOCKET_PATH):
+        self.socket_path = socket_path
+
+    def _call(self, request, audio=None, timeout=None):
+        import numpy as np
+        if isinstance(audio, np.ndarray):
+            request["audio_samples"] = len(audio)
+        elif audio is not None:
+            request["audio_path"] = os.path.abspath(audio)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(timeout)
+            conn.connect(self.socket_path)
+            send_frame(conn, to_json(request))
+            if isinstance(audio, np.ndarray):
+                send_frame(conn, np.ascontiguousarray(audio, dtype=np.float32).tobytes())
+            response = json.loads(recv_frame(conn))
+
+        if not response.get("ok"):
+            raise RuntimeError(f"Model server error: {response.get('error')}")
+        return response["result"]
+
+    def transcribe(self, audio, **options):
+        return self._call({"op": "transcribe", "options": options}, audio)
+
+    def identify_language(self, audio):
+        return self._call({"op": "detect_language"}, audio)
+
+    def info(self, timeout=5):
+        # Connecting proves a server is listening (a stale socket file refuses at once);
+        # the backlog accepts the connection even while every worker is busy
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(timeout)
+            conn.connect(self.socket_path)
+        with open(info_path(self.socket_path)) as f:
+            return json.load(f)
+
+def server_available(socket_path=SOCKET_PATH):
+    return bool(socket_path) and os.path.exists(socket_path)
+
+def load_model(name=WHISPER_MODEL):
+    # A stale socket file (server killed without cleanup) must not route every file to a dead server
+    if server_available():
+        client = WhisperClient()
+        try:
+            served = client.info()["model"]
+        except Exception as e:
+            log(f"⚠️ Whisper server at {SOCKET_PATH} isn't answering ({e}), loading the model in-process.")
+        else:
+            if served == name:
+                log(f"🔌 Using shared Whisper server at {SOCKET_PATH}")
+                return client
+            log(f"⚠️ Whisper server runs '{served}' but '{name}' was requested, loading the model in-process.")
+    import whisper
+    return whisper.load_model(name)
+
+# === 🧵 Worker: accept only while idle, so a busy worker never holds new requests ===
+# The listening socket is non-blocking and shared by every worker; only workers waiting
+# in select() pick up connections, so the kernel backlog acts as the shared queue.
+class Job:
+    def __init__(self, conn, request, audio):
+        self.conn = conn
+        self.request = request
+        self.audio = audio
+        self.mel = None
+
+    def finish(self, response):
+        try:
+            send_frame(self.conn, to_json(response))
+        except Exception as e:
+            log(f"⚠️ Couldn't reply to client: {e}")
+        finally:
+            self.conn.close()
+
+def error_response(e):
+    return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+def read_job(conn, model, request):
+    import numpy as np
+    if "audio_samples" in request:
+        audio = np.frombuffer(recv_frame(conn), dtype=np.float32).copy()
+    else:
+        audio = request["audio_path"]
+
+    job = Job(conn, request, audio)
+    if request["op"] == "detect_language":
+        # Decode + mel up front so the batch only runs the model
+        job.mel = clip_mel(model, audio)
+    return job
+
+def accept_job(server, model, timeout=None):
+    # None when nothing arrived in time, another idle worker won the connection, or the request was bad
+    ready, _, _ = select.select([server], [], [], timeout)
+    if not ready:
+        return None
+    try:
+        conn, _ = server.accept()
+    except BlockingIOError:
+        return None
+    conn.setblocking(True)
+    try:
+        return read_job(conn, model, json.loads(recv_frame(conn)))
+    except ConnectionError:
+        # Client went away, e.g. load_model's liveness probe
+        conn.close()
+        return None
+    except Exception as e:
+        Job(conn, None, None).finish(error_response(e))
+        return None
+
+def run_batch(model, batch):
+    try:
+        languages = detect_languages(model, [job.mel for job in batch])
+    except Exception as e:
+        for job in batch:
+            job.finish(error_response(e))
+        return
+    for job, lang in zip(batch, languages):
+        job.finish({"ok": True, "result": lang})
+
+def run_transcribe(model, job):
+    try:
+        options = dict(job.request.get("options") or {})
+        result = model.transcribe(job.audio, **options)
+    except Exception as e:
+        job.finish(error_response(e))
+        return
+    job.finish({"ok": True, "result": result})
+
+def inference_loop(server, model):
+    deferred = collections.deque()
+    while True:
+        job = deferred.popleft() if deferred else accept_job(server, model)
+        if job is None:
+            continue
+        if job.request["op"] != "detect_language":
+            run_transcribe(model, job)
+            continue
+
+        # Micro-batch short clips that arrive within the batching window
+        batch = [job]
+        deadline = time.monotonic() + BATCH_WINDOW_SECONDS
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            nxt = accept_job(server, model, remaining)
+            if nxt:
+                (batch if nxt.request["op"] == "detect_language" else deferred).append(nxt)
+        run_batch(model, batch)
+
+def worker_main(server, model):
+    import torch
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // WORKERS))
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    inference_loop(server, model)
+
+# === 🚀 MAIN (pre-fork: load once, share weights copy-on-write) ===
+def spawn_worker(server, model):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            worker_main(server, model)
+        finally:
+            os._exit(1)
+    return pid
+
+def main():
+    import torch
+    import whisper
+
+    log(f"🎙️ Loading Whisper model '{WHISPER_MODEL}' once for {WORKERS} worker(s)...")
+    torch.set_grad_enabled(False)
+    model = whisper.load_model(WHISPER_MODEL).eval()
+
+    if os.path.exists(SOCKET_PATH):
+        os.remove(SOCKET_PATH)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(SOCKET_PATH)
+    os.chmod(SOCKET_PATH, 0o600)
+    server.listen(64)
+    # Idle workers race for each connection; the losers get BlockingIOError and keep waiting
+    server.setblocking(False)
+    with open(info_path(), "w") as f:
+        json.dump({"model": WHISPER_MODEL, "pid": os.getpid()}, f)
+
+    workers = {spawn_worker(server, model) for _ in range(WORKERS)}
+    log(f"✅ Whisper server listening on {SOCKET_PATH}")
+
+    def shutdown(signum, frame):
+        log("🛑 Shutting down Whisper server...")
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for path in (SOCKET_PATH, info_path()):
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    # Keep the pool at full size if a worker dies
+    while True:
+        pid, status = os.wait()
+        if pid in workers:
+            workers.discard(pid)
+            log(f"⚠️ Worker {pid} exited ({status}), restarting.")
+            workers.add(spawn_worker(server, model))
+
+if __name__ == "__main__":
+    main()
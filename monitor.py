@@ -2,10 +2,8 @@
 
 import os
 from datetime import datetime
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from supabase import create_client
 import config
+import dedup
 
 # === 🧠 Constants ===
 AUDIO_MIME_TYPES = [
@@ -26,10 +24,13 @@ def log(msg):
 
 # === 🔌 INIT SUPABASE ===
 def init_supabase():
+    from supabase import create_client
     return create_client(config.SUPABASE_URL, config.SUPABASE_API_KEY)
 
 # === 🔌 INIT GOOGLE DRIVE ===
 def init_drive_service():
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
     creds = service_account.Credentials.from_service_account_file(
         config.SERVICE_ACCOUNT_FILE,
         scopes=["https://www.googleapis.com/auth/drive"]
@@ -42,7 +43,7 @@ def list_audio_files(service):
     results = service.files().list(
         q=query,
         spaces='drive',
-        fields="files(id, name, mimeType)"
+        fields="files(id, name, mimeType, md5Checksum)"
     ).execute()
 
     files = results.get("files", [])
@@ -60,10 +61,27 @@ def get_existing_filenames(supabase):
 # === ➕ Insert file record ===
 def insert_new_file_record(supabase, file):
     log(f"🆕 Inserting new file: {file['name']}")
-    supabase.table("audio_files").insert({
+    result = supabase.table("audio_files").insert({
         "filename": file["name"],
+        "drive_file_id": file["id"],
+        "md5_checksum": file.get("md5Checksum"),
         "status": "new"
     }).execute()
+    return result.data[0] if result.data else None
+
+# === 🔗 Link a re-upload to the record with the same content ===
+def insert_duplicate_record(supabase, file, original_id):
+    record = dedup.link_fields(supabase, original_id)
+    if record["status"] == "duplicate":
+        log(f"♻️ {file['name']} has the same content as record {original_id}, linking instead of reprocessing.")
+    else:
+        log(f"⏳ {file['name']} has the same content as record {original_id}, waiting for it to finish.")
+    record.update({
+        "filename": file["name"],
+        "drive_file_id": file["id"],
+        "md5_checksum": file.get("md5Checksum"),
+    })
+    supabase.table("audio_files").insert(record).execute()
 
 # === 🚀 MAIN ===
 def main():
@@ -83,8 +101,28 @@ def main():
         new_files = [f for f in audio_files if f["name"] not in existing_files]
 
         log(f"🆕 Found {len(new_files)} new audio file(s).")
+
+        try:
+            checksums = dedup.load_checksum_index(supabase) if new_files else {}
+        except Exception as e:
+            log(f"⚠️ Couldn't load checksum index, skipping dedup: {e}")
+            checksums = {}
+
         for file in new_files:
-            insert_new_file_record(supabase, file)
+            original_id = checksums.get(file.get("md5Checksum"))
+            if original_id:
+                insert_duplicate_record(supabase, file, original_id)
+                continue
+
+            inserted = insert_new_file_record(supabase, file)
+            # Same content uploaded twice in one batch waits on the first copy
+            if inserted and file.get("md5Checksum"):
+                checksums[file["md5Checksum"]] = inserted["id"]
+
+        try:
+            dedup.resolve_pending(supabase, log)
+        except Exception as e:
+            log(f"⚠️ Couldn't resolve pending duplicates: {e}")
 
         log("✅ Monitoring complete.")
         return len(new_files) > 0
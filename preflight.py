@@ -0,0 +1,127 @@
+# preflight.py — One count query per stage queue so idle cron ticks exit without starting any stage
+#
+# Only the standard library and config are imported here: the stage modules keep
+# whisper/torch, openai, supabase and the Google clients inside their functions.
+# Exits 0 when some stage has work, 1 when every queue is empty.
+
+import os
+import sys
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+import config
+import clean_text
+import create_doc
+import detect_language
+import summarize
+import transcribe
+
+# Failure statuses the stages also retry. A row stuck in one of them would keep its
+# queue non-empty forever, so they don't count as work on every tick. Instead they
+# count once every RETRY_INTERVAL_MINUTES, so a row that failed on a transient
+# OpenAI, Drive or Supabase error is retried within that interval even when no new
+# work arrives; rows that keep failing are retried at that pace, not every tick.
+RETRY_STATUSES = {"error", "summary_error"}
+RETRY_INTERVAL_MINUTES = getattr(config, "RETRY_INTERVAL_MINUTES", 60)
+RETRY_STAMP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "last_retry")
+
+def pending_statuses(statuses):
+    return [s for s in statuses if s not in RETRY_STATUSES]
+
+# Script name -> statuses that count as queued work
+STAGE_QUEUES = {
+    "detect_language.py": pending_statuses(detect_language.QUEUE_STATUSES),
+    "transcribe.py": pending_statuses(transcribe.QUEUE_STATUSES),
+    "clean_text.py": pending_statuses(clean_text.QUEUE_STATUSES),
+    "summarize.py": pending_statuses(summarize.QUEUE_STATUSES),
+    "create_doc.py": pending_statuses(create_doc.QUEUE_STATUSES),
+}
+
+# Script name -> every status the stage picks up, used when a retry is due
+RETRY_QUEUES = {
+    "detect_language.py": detect_language.QUEUE_STATUSES,
+    "transcribe.py": transcribe.QUEUE_STATUSES,
+    "clean_text.py": clean_text.QUEUE_STATUSES,
+    "summarize.py": summarize.QUEUE_STATUSES,
+    "create_doc.py": create_doc.QUEUE_STATUSES,
+}
+
+# === 🕒 Logger ===
+def log(msg):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    formatted = f"[{timestamp}] {msg}"
+    print(formatted)
+    try:
+        with open("log.txt", "a") as f:
+            f.write(formatted + "\n")
+    except Exception as e:
+        print(f"[Logger Error] Could not write to log.txt: {e}")
+
+# === 🔢 Count rows via PostgREST (HEAD + Prefer: count=exact, no body transferred) ===
+def count_status(statuses, timeout=10):
+    query = urllib.parse.urlencode({"select": "id", "status": f"in.({','.join(statuses)})"})
+    request = urllib.request.Request(
+        f"{config.SUPABASE_URL}/rest/v1/audio_files?{query}",
+        method="HEAD",
+        headers={
+            "apikey": config.SUPABASE_API_KEY,
+            "Authorization": f"Bearer {config.SUPABASE_API_KEY}",
+            "Prefer": "count=exact",
+        },
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        content_range = response.headers.get("Content-Range", "*/0")
+    return int(content_range.rsplit("/", 1)[1])
+
+def queue_counts(steps, include_retries=False):
+    queues = RETRY_QUEUES if include_retries else STAGE_QUEUES
+    counts = {}
+    for step in steps:
+        statuses = queues.get(os.path.basename(step))
+        counts[step] = count_status(statuses) if statuses else None
+    return counts
+
+# === 🔁 Retry schedule (mtime of a stamp file, like pipeline.lock) ===
+def retry_due():
+    try:
+        return time.time() - os.path.getmtime(RETRY_STAMP_FILE) >= RETRY_INTERVAL_MINUTES * 60
+    except OSError:
+        return True
+
+def mark_retried():
+    try:
+        open(RETRY_STAMP_FILE, "w").close()
+    except Exception as e:
+        log(f"⚠️ Couldn't write {RETRY_STAMP_FILE}: {e}")
+
+# === 🧭 Which steps need to run ===
+def steps_with_work(steps):
+    # Everything downstream of the first non-empty queue runs, since it can receive work this tick
+    retry = retry_due()
+    try:
+        counts = queue_counts(steps, include_retries=retry)
+    except Exception as e:
+        log(f"⚠️ Preflight failed, running every step: {e}")
+        return list(steps)
+
+    if retry:
+        log(f"🔁 Including failed rows ({', '.join(sorted(RETRY_STATUSES))}) in this tick's queues.")
+        mark_retried()
+
+    for i, step in enumerate(steps):
+        # Steps without a known queue always run
+        if counts[step] is None or counts[step] > 0:
+            return list(steps[i:])
+    return []
+
+# === 🚀 MAIN ===
+def main():
+    counts = queue_counts(list(STAGE_QUEUES))
+    for step, count in counts.items():
+        log(f"📊 {step}: {count} record(s) waiting")
+    return any(counts.values())
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
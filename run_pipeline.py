@@ -2,6 +2,8 @@ import subprocess
 import os
 from datetime import datetime
 
+import preflight
+
 # === 🕒 Logger ===
 def log(msg):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -42,6 +44,11 @@ def main():
         "create_doc.py"
     ]
 
+    steps = preflight.steps_with_work(steps)
+    if not steps:
+        log("😴 All stage queues are empty. Nothing to do.")
+        return
+
     for step in steps:
         if not run_step(step):
             log(f"❌ Halting pipeline due to failure in: {step}")
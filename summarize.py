@@ -3,13 +3,13 @@
 import os
 import sys
 from datetime import datetime
-from supabase import create_client
-import openai
-from openai.error import OpenAIError
 import config
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+# Stage queue, also counted by preflight.py
+QUEUE_STATUSES = ["cleaned", "summary_error"]
+
 # === Logger ===
 def log(msg):
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -23,9 +23,13 @@ def log(msg):
 
 # === Supabase & OpenAI ===
 def init_supabase():
+    from supabase import create_client
     return create_client(config.SUPABASE_URL, config.SUPABASE_API_KEY)
 
-openai.api_key = config.OPENAI_API_KEY
+def init_openai():
+    import openai
+    openai.api_key = config.OPENAI_API_KEY
+    return openai
 
 # === Parser ===
 def parse_summary_output(output):
@@ -68,10 +72,15 @@ def summarize_text(text):
         "## Action Items\n"
         "- First action\n"
         "- Second action\n\n"
+        "If the transcription labels speakers (e.g. \"Speaker 1: ...\"), start each action item with its owner "
+        "(e.g. \"- Speaker 2: Send the report\").\n\n"
         "Do not include any extra text or introduction.\n\n"
         f"Meeting transcription:\n{text}"
     )
 
+    openai = init_openai()
+    from openai.error import OpenAIError
+
     models = ["gpt-4", "gpt-3.5-turbo-16k"]
     for model in models:
         try:
@@ -88,51 +97,57 @@ def summarize_text(text):
                 break
     return None
 
+# === Summarize One Record ===
+def process_record(sb, record):
+    file_id = record["id"]
+    filename = record["filename"]
+    text = record.get("cleaned_text")
+
+    if not text:
+        log(f"⚠️ Skipping {filename} — no cleaned text found.")
+        return False
+
+    log(f"🧠 Summarizing: {filename}")
+    summary = summarize_text(text)
+
+    if not summary:
+        sb.table("audio_files").update({"status": "summary_error"}).eq("id", file_id).execute()
+        return False
+
+    action_items, talking_points = parse_summary_output(summary)
+
+    if action_items and talking_points:
+        sb.table("audio_files").update({
+            "status": "summarized",
+            "summary_points": talking_points,
+            "action_items": action_items,
+            "full_summary": summary
+        }).eq("id", file_id).execute()
+        log(f"✅ Summary complete for: {filename}")
+        return True
+
+    log(f"⚠️ Failed to extract bullet points for {filename}, saving raw summary.")
+    log("📄 GPT returned:\n" + summary)
+    sb.table("audio_files").update({
+        "status": "summary_error",
+        "full_summary": summary
+    }).eq("id", file_id).execute()
+    return False
+
 # === Main ===
 def main():
     log("📦 Fetching records with status='cleaned' or 'summary_error'...")
     sb = init_supabase()
     records = sb.table("audio_files").select(
         "id, filename, cleaned_text, status"
-    ).in_("status", ["cleaned", "summary_error"]).execute().data
+    ).in_("status", QUEUE_STATUSES).execute().data
 
     if not records:
         log("🟡 No cleaned records to summarize.")
         return
 
     for record in records:
-        file_id = record["id"]
-        filename = record["filename"]
-        text = record.get("cleaned_text")
-
-        if not text:
-            log(f"⚠️ Skipping {filename} — no cleaned text found.")
-            continue
-
-        log(f"🧠 Summarizing: {filename}")
-        summary = summarize_text(text)
-
-        if not summary:
-            sb.table("audio_files").update({"status": "summary_error"}).eq("id", file_id).execute()
-            continue
-
-        action_items, talking_points = parse_summary_output(summary)
-
-        if action_items and talking_points:
-            sb.table("audio_files").update({
-                "status": "summarized",
-                "summary_points": talking_points,
-                "action_items": action_items,
-                "full_summary": summary
-            }).eq("id", file_id).execute()
-            log(f"✅ Summary complete for: {filename}")
-        else:
-            log(f"⚠️ Failed to extract bullet points for {filename}, saving raw summary.")
-            log("📄 GPT returned:\n" + summary)
-            sb.table("audio_files").update({
-                "status": "summary_error",
-                "full_summary": summary
-            }).eq("id", file_id).execute()
+        process_record(sb, record)
 
     log("✅ Step Complete: Summarization finished.")
 
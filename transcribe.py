@@ -3,17 +3,33 @@
 import os
 import sys
 import io
-import whisper
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from supabase import create_client
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 
 import config
+import dedup
+import model_server
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+# Stage queue, also counted by preflight.py
+QUEUE_STATUSES = ["new", "transcribing"]
+
+# Whisper checkpoint; stored per record as whisper_model so backfills can target it
+# (column added by migrations/002_whisper_model.sql)
+WHISPER_MODEL = getattr(config, "WHISPER_MODEL", "medium")
+
+# Experimental CPU speaker diarization, run in parallel with Whisper (see diarize.py)
+DIARIZATION = getattr(config, "ENABLE_DIARIZATION", False)
+
+# Optional streaming: transcribe in chunks, appending each to transcript_chunks as it's produced
+# (table added by migrations/004_transcript_chunks.sql)
+STREAMING = getattr(config, "STREAMING_TRANSCRIPTION", False)
+STREAM_CHUNK_SECONDS = getattr(config, "STREAM_CHUNK_SECONDS", 120)
+STREAM_FIRST_CHUNK_SECONDS = getattr(config, "STREAM_FIRST_CHUNK_SECONDS", 30)
+# Clean finalized chunks with GPT while later audio is still being transcribed
+STREAM_CLEANING = getattr(config, "STREAM_CLEANING", False)
+
 # === 🕒 Logger ===
 def log(msg):
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -27,9 +43,12 @@ def log(msg):
 
 # === 🔌 INIT SERVICES ===
 def init_supabase():
+    from supabase import create_client
     return create_client(config.SUPABASE_URL, config.SUPABASE_API_KEY)
 
 def init_drive_service():
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
     creds = service_account.Credentials.from_service_account_file(
         config.SERVICE_ACCOUNT_FILE,
         scopes=["https://www.googleapis.com/auth/drive"]
@@ -38,6 +57,7 @@ def init_drive_service():
 
 # === 🔽 DOWNLOAD AUDIO FROM DRIVE ===
 def download_from_drive(filename, drive_service, download_path="downloads"):
+    from googleapiclient.http import MediaIoBaseDownload
     log(f"🔽 Downloading from Drive: {filename}")
     query = f"name='{filename}' and '{config.INPUT_FOLDER_ID}' in parents and trashed = false"
     results = drive_service.files().list(
@@ -67,60 +87,286 @@ def download_from_drive(filename, drive_service, download_path="downloads"):
     return local_path
 
 # === 🧠 TRANSCRIBE + DETECT LANGUAGE ===
-def transcribe_audio(model, file_path):
+def transcribe_audio(model, audio):
     try:
-        result = model.transcribe(file_path, fp16=False)
-        return result["text"], result.get("language", "unknown")
+        result = model.transcribe(audio, fp16=False)
+        return result["text"], result.get("language", "unknown"), result.get("segments", [])
     except Exception as e:
-        log(f"❌ Transcription failed for {file_path}: {e}")
-        return None, None
+        log(f"❌ Transcription failed: {e}")
+        return None, None, []
 
-# === 🚀 MAIN ===
-def main():
-    log("🎙️ Loading Whisper model...")
-    model = whisper.load_model("medium")  # or "medium" for CPU-friendly
+# === 🗣️ SPEAKER LABELS ===
+def label_speakers(job, segments):
+    import diarize
+    try:
+        labelled = diarize.finish_diarization(job, segments)
+    except Exception as e:
+        log(f"⚠️ Diarization failed, keeping plain transcript: {e}")
+        diarize.cancel_diarization(job)
+        return None
+    if not labelled:
+        return None
+    return [
+        {"start": seg["start"], "end": seg["end"], "speaker": seg["speaker"], "text": seg["text"].strip()}
+        for seg in labelled
+    ]
 
-    log("📦 Connecting to Supabase...")
-    supabase = init_supabase()
-    drive_service = init_drive_service()
+# === 📡 STREAMING TRANSCRIPTION ===
+def find_cut(audio, target, search_seconds=2.0, frame_seconds=0.02):
+    # Cut at the quietest frame near the target so chunks don't split words
+    import whisper
+    sr = whisper.audio.SAMPLE_RATE
+    frame = int(frame_seconds * sr)
+    lo = max(target - int(search_seconds * sr), 0)
+    hi = min(target + int(search_seconds * sr), len(audio))
+    frames = (hi - lo) // frame
+    if frames < 1:
+        return target
+    energy = (audio[lo:lo + frames * frame].reshape(frames, frame) ** 2).mean(axis=1)
+    return lo + int(energy.argmin()) * frame
 
-    result = supabase.table("audio_files").select("id", "filename", "status").eq("status", "new").execute()
-    files = result.data if result.data else []
+def reset_chunks(supabase, file_id):
+    # A restarted stream must not leave chunks from the previous attempt behind
+    supabase.table("transcript_chunks").delete().eq("audio_file_id", file_id).execute()
 
-    if not files:
-        log("🟡 No new files to transcribe.")
-        return
+def publish_cleaned_chunks(supabase, file_id, cleaned_futures, published):
+    for chunk_index, future in cleaned_futures:
+        if chunk_index in published or not future.done() or future.exception() or not future.result():
+            continue
+        supabase.table("transcript_chunks").update({"cleaned_text": future.result()}).eq(
+            "audio_file_id", file_id
+        ).eq("chunk_index", chunk_index).execute()
+        published.add(chunk_index)
 
-    for file in files:
-        filename = file['filename']
-        file_id = file['id']
-        log(f"🔤 Transcribing: {filename}")
+def transcribe_streaming(supabase, model, file_id, audio, clean_chunks=False):
+    import whisper
+    sr = whisper.audio.SAMPLE_RATE
+    total = len(audio)
+    texts, segments, lang = [], [], None
 
+    cleaner, cleaned_futures, published = None, [], set()
+    if clean_chunks:
+        import clean_text
+        cleaner = ThreadPoolExecutor(max_workers=1)
+
+    start = 0
+    try:
+        reset_chunks(supabase, file_id)
+        while start < total:
+            # A short first chunk gets something on screen quickly
+            chunk_size = int((STREAM_CHUNK_SECONDS if texts else STREAM_FIRST_CHUNK_SECONDS) * sr)
+            # Let the last chunk absorb a short tail instead of transcribing a sliver
+            end = total if total - start <= chunk_size * 1.25 else find_cut(audio, start + chunk_size)
+
+            options = {"fp16": False}
+            if lang:
+                options["language"] = lang
+            if texts:
+                options["initial_prompt"] = texts[-1][-200:]
+            result = model.transcribe(audio[start:end], **options)
+
+            lang = lang or result.get("language", "unknown")
+            offset = start / sr
+            chunk_segments = [
+                {"start": seg["start"] + offset, "end": seg["end"] + offset, "text": seg["text"]}
+                for seg in result.get("segments", [])
+            ]
+            segments += chunk_segments
+            chunk_index, chunk_text = len(texts), result["text"].strip()
+            texts.append(chunk_text)
+
+            # Append only this chunk's segments; the full transcript is written once at the end
+            supabase.table("transcript_chunks").insert({
+                "audio_file_id": file_id,
+                "chunk_index": chunk_index,
+                "start": offset,
+                "end": end / sr,
+                "text": chunk_text,
+                "segments": chunk_segments,
+            }).execute()
+
+            progress = int(end * 100 / total)
+            supabase.table("audio_files").update({
+                "status": "transcribing",
+                "language": lang,
+                "transcription_progress": progress,
+            }).eq("id", file_id).execute()
+
+            if cleaner and chunk_text:
+                cleaned_futures.append((chunk_index, cleaner.submit(clean_text.clean_text_gpt, chunk_text)))
+                publish_cleaned_chunks(supabase, file_id, cleaned_futures, published)
+
+            log(f"📡 {progress}% transcribed")
+            start = end
+    except Exception as e:
+        log(f"❌ Streaming transcription failed: {e}")
+        if cleaner:
+            cleaner.shutdown(cancel_futures=True)
         try:
-            local_path = download_from_drive(filename, drive_service)
+            reset_chunks(supabase, file_id)
+        except Exception as cleanup_err:
+            log(f"⚠️ Couldn't clear partial chunks: {cleanup_err}")
+        return None, None, [], None
+
+    cleaned = None
+    if cleaner:
+        try:
+            results = [future.result() for _, future in cleaned_futures]
+            publish_cleaned_chunks(supabase, file_id, cleaned_futures, published)
+            if results and all(results):
+                cleaned = "\n\n".join(results)
+            else:
+                log("⚠️ Some chunks weren't cleaned, leaving cleaning to the clean step.")
         except Exception as e:
-            log(f"❌ Failed to download {filename} from Drive: {e}")
-            supabase.table("audio_files").update({"status": "error"}).eq("id", file_id).execute()
-            continue
+            log(f"⚠️ Chunk cleaning failed, leaving cleaning to the clean step: {e}")
+        finally:
+            cleaner.shutdown()
 
-        text, lang = transcribe_audio(model, local_path)
-        if not text:
-            supabase.table("audio_files").update({"status": "error"}).eq("id", file_id).execute()
-            continue
+    return " ".join(t for t in texts if t), lang, segments, cleaned
 
+# === ♻️ DUPLICATE AUDIO ===
+def fingerprint_audio(local_path):
+    try:
+        fingerprint, duration = dedup.compute_fingerprint(local_path)
+    except Exception as e:
+        log(f"⚠️ Fingerprinting failed, transcribing normally: {e}")
+        return None
+    if not fingerprint:
+        return None
+    return {"audio_fingerprint": fingerprint, "audio_duration": duration}
+
+def find_duplicate(supabase, fingerprint, file_id):
+    try:
+        return dedup.find_fingerprint_match(
+            supabase, fingerprint["audio_fingerprint"], fingerprint["audio_duration"], exclude_id=file_id
+        )
+    except Exception as e:
+        log(f"⚠️ Fingerprint lookup failed, transcribing normally: {e}")
+        return None
+
+def remove_temp_file(local_path):
+    try:
+        os.remove(local_path)
+    except Exception as cleanup_err:
+        log(f"⚠️ Couldn't delete temp file: {cleanup_err}")
+
+# === 🔤 PROCESS ONE FILE ===
+def process_file(supabase, drive_service, model, file, check_duplicates=True):
+    filename = file['filename']
+    file_id = file['id']
+    log(f"🔤 Transcribing: {filename}")
+
+    try:
+        local_path = download_from_drive(filename, drive_service)
+    except Exception as e:
+        log(f"❌ Failed to download {filename} from Drive: {e}")
+        supabase.table("audio_files").update({"status": "error"}).eq("id", file_id).execute()
+        return False
+
+    fingerprint = fingerprint_audio(local_path) if dedup.FINGERPRINT_DEDUP else None
+    if fingerprint and check_duplicates:
+        original_id = find_duplicate(supabase, fingerprint, file_id)
+        if original_id:
+            log(f"♻️ {filename} sounds like record {original_id}, linking instead of transcribing.")
+            supabase.table("audio_files").update(dict(
+                dedup.link_fields(supabase, original_id), **fingerprint
+            )).eq("id", file_id).execute()
+            remove_temp_file(local_path)
+            return True
+
+    audio, diarization_job = local_path, None
+    try:
+        if DIARIZATION or STREAMING:
+            import whisper
+            audio = whisper.load_audio(local_path)
+        if DIARIZATION:
+            import diarize
+            diarization_job = diarize.start_diarization(audio)
+    except Exception as e:
+        # Corrupt or unsupported uploads fail here now that decoding happens outside transcribe_audio
+        log(f"❌ Failed to decode {filename}: {e}")
         supabase.table("audio_files").update({
-            "status": "transcribed",
-            "transcription": text,
-            "language": lang,
-            "error_message": ""
+            "status": "error",
+            "error_message": str(e)
         }).eq("id", file_id).execute()
+        remove_temp_file(local_path)
+        return False
+
+    cleaned = None
+    if STREAMING:
+        # Speaker labels are only known at the end, so chunk cleaning would drop them
+        text, lang, segments, cleaned = transcribe_streaming(
+            supabase, model, file_id, audio, clean_chunks=STREAM_CLEANING and not DIARIZATION
+        )
+    else:
+        text, lang, segments = transcribe_audio(model, audio)
+
+    if not text:
+        if diarization_job:
+            diarize.cancel_diarization(diarization_job)
+        failed = {"status": "error"}
+        supabase.table("audio_files").update(failed).eq("id", file_id).execute()
+        return False
+
+    update = {
+        "status": "transcribed",
+        "transcription": text,
+        "language": lang,
+        "whisper_model": WHISPER_MODEL,
+        "error_message": ""
+    }
+    if fingerprint:
+        update.update(fingerprint)
+    if STREAMING:
+        update["transcription_progress"] = 100
+    if cleaned:
+        update.update({"status": "cleaned", "cleaned_text": cleaned})
 
-        log(f"✅ Transcription complete for: {filename} — language: {lang}")
+    if diarization_job:
+        # transcription stays Whisper's output; the labelled copy lives next to it so a bad
+        # clustering can be discarded or recomputed without losing the source text
+        speaker_segments = label_speakers(diarization_job, segments)
+        update["segments"] = speaker_segments
+        update["speaker_transcript"] = (
+            diarize.format_speaker_transcript(speaker_segments) if speaker_segments else None
+        )
 
+    supabase.table("audio_files").update(update).eq("id", file_id).execute()
+
+    log(f"✅ Transcription complete for: {filename} — language: {lang}")
+
+    remove_temp_file(local_path)
+    return True
+
+# === 🚀 MAIN ===
+def main():
+    log("📦 Connecting to Supabase...")
+    supabase = init_supabase()
+
+    # 'transcribing' rows are streamed runs that were interrupted; start them over
+    result = supabase.table("audio_files").select("id", "filename", "status").in_(
+        "status", QUEUE_STATUSES
+    ).execute()
+    files = result.data if result.data else []
+
+    if not files:
+        log("🟡 No new files to transcribe.")
+        return
+
+    # Only pay for the model and Drive client once there's work
+    log("🎙️ Loading Whisper model...")
+    model = model_server.load_model(WHISPER_MODEL)
+    drive_service = init_drive_service()
+
+    for file in files:
         try:
-            os.remove(local_path)
-        except Exception as cleanup_err:
-            log(f"⚠️ Couldn't delete temp file: {cleanup_err}")
+            process_file(supabase, drive_service, model, file)
+        except Exception as e:
+            log(f"❌ Error transcribing {file['filename']}: {type(e).__name__}: {e}")
+            supabase.table("audio_files").update({
+                "status": "error",
+                "error_message": str(e)
+            }).eq("id", file["id"]).execute()
 
     log("✅ Step Complete: Transcription and language detection finished.")
 